@@ -0,0 +1,161 @@
+"""Micro benchmarks for the response pipeline and the prepared statement cache.
+
+Usage: python benchmark.py [serialization [rows] | fetch [repeat] | statements [calls]]
+The fetch and statements benchmarks run read-only queries against DATABASE_URL.
+"""
+import gzip
+import sys
+import time
+from datetime import datetime, timedelta
+
+import psycopg2
+from flask.json.provider import DefaultJSONProvider
+from psycopg2.extras import RealDictCursor
+
+import main
+
+
+def build_payloads(rows):
+    now = datetime.now()
+    users = [{
+        "id": i,
+        "fullname": f"مستخدم تجريبي {i}",
+        "username": f"user{i}",
+        "email": f"user{i}@example.com",
+        "last_login": (now - timedelta(hours=i)).strftime("%Y-%m-%d %H:%M:%S"),
+        "banned_until": None,
+        "permanently_banned": 0,
+        "is_admin": i % 50 == 0
+    } for i in range(rows)]
+    news = [{
+        "id": i,
+        "title": f"عنوان الخبر رقم {i}",
+        "content": "موقع متطور للذكاء الاصطناعي يساعدك في العديد من المهام اليومية والبرمجية " * 5,
+        "image_url": f"https://example.com/news/{i}.jpg",
+        "status": "published",
+        "type": "خبر",
+        "created_at": now - timedelta(days=i)
+    } for i in range(rows)]
+    messages = [{
+        "id": i,
+        "chat_id": 1,
+        "user_id": 1 + i % 2,
+        "message": f"رسالة دعم فني رقم {i}، هل يمكنكم المساعدة؟",
+        "image_url": "",
+        "created_at": now - timedelta(minutes=i),
+        "fullname": "Admin User" if i % 2 else "مستخدم تجريبي",
+        "profile_image": "https://ui-avatars.com/api/?name=Admin+User&background=3498db&color=fff"
+    } for i in range(rows)]
+    return {"/users": users, "/news": news, "/support-messages/<id>": messages}
+
+
+def timed(fn, repeat=20):
+    start = time.process_time()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.process_time() - start) / repeat * 1000
+
+
+def serialization_benchmark(rows):
+    stdlib = DefaultJSONProvider(main.app)
+    print(f"rows per endpoint: {rows}, orjson: {main.orjson is not None}, brotli: {main.brotli is not None}")
+    print(f"{'endpoint':<24}{'stdlib bytes':>14}{'stdlib ms':>11}{'fast bytes':>12}{'fast ms':>9}"
+          f"{'gzip bytes':>12}{'gzip ms':>9}{'br bytes':>10}{'br ms':>8}")
+    for endpoint, payload in build_payloads(rows).items():
+        baseline, baseline_ms = timed(lambda: stdlib.dumps(payload).encode("utf-8"))
+        fast, fast_ms = timed(lambda: main.dumps_json(payload))
+        gzipped, gzip_ms = timed(lambda: gzip.compress(fast, compresslevel=main.COMPRESS_GZIP_LEVEL))
+        line = (f"{endpoint:<24}{len(baseline):>14}{baseline_ms:>11.2f}{len(fast):>12}{fast_ms:>9.2f}"
+                f"{len(gzipped):>12}{gzip_ms:>9.2f}")
+        if main.brotli is not None:
+            compressed, br_ms = timed(lambda: main.brotli.compress(fast, quality=main.COMPRESS_BROTLI_LEVEL))
+            line += f"{len(compressed):>10}{br_ms:>8.2f}"
+        print(line)
+
+
+def fetch_benchmark(repeat):
+    routes = {
+        "/users": "SELECT id, fullname, username, email, last_login, banned_until, permanently_banned, is_admin FROM users",
+        "/news": main.NEWS_LIST_QUERY,
+        "/support-chats": """
+            SELECT sc.*, u.fullname, u.username, u.profile_image
+            FROM support_chats sc
+            JOIN users u ON sc.user_id = u.id
+        """,
+    }
+    conn = psycopg2.connect(main.DATABASE_URL)
+
+    def dict_rows(query):
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(query)
+        return cursor.fetchall()
+
+    def tuple_rows(query):
+        cursor = main.tuple_cursor(conn)
+        cursor.execute(query)
+        return main.fetch_rows(cursor)
+
+    print(f"best of {repeat} runs, CPU ms per request")
+    print(f"{'endpoint':<24}{'rows':>8}{'dict fetch':>12}{'tuple fetch':>13}"
+          f"{'dict + json':>13}{'tuple + json':>14}{'saved':>8}")
+    for endpoint, query in routes.items():
+        timings = []
+        for fetch in (dict_rows, tuple_rows):
+            for encode in (False, True):
+                best = None
+                for _ in range(repeat):
+                    start = time.process_time()
+                    rows = fetch(query)
+                    if encode:
+                        main.dumps_json(rows)
+                    elapsed = (time.process_time() - start) * 1000
+                    best = elapsed if best is None else min(best, elapsed)
+                timings.append(best)
+        dict_fetch, dict_total, tuple_fetch, tuple_total = timings
+        saved = (1 - tuple_total / dict_total) * 100 if dict_total else 0
+        print(f"{endpoint:<24}{len(rows):>8}{dict_fetch:>12.2f}{tuple_fetch:>13.2f}"
+              f"{dict_total:>13.2f}{tuple_total:>14.2f}{saved:>7.0f}%")
+        conn.rollback()
+    conn.close()
+
+
+def statements_benchmark(calls):
+    routes = {
+        "/login": (main.LOGIN_QUERY, ("admin", main.hash_password("1234"))),
+        "/settings": (main.SETTINGS_QUERY, None),
+        "/news": (main.NEWS_LIST_QUERY, None),
+        "/support-messages/<id>": (main.SUPPORT_MESSAGES_QUERY, (1,)),
+        "/user/<id>": (main.USERS_BY_IDS_QUERY, ([1],)),
+    }
+    plain_conn = psycopg2.connect(main.DATABASE_URL, cursor_factory=RealDictCursor)
+    prepared_conn = main.get_connection()
+    print(f"calls per route: {calls}")
+    print(f"{'route':<24}{'planning ms':>13}{'text ms':>10}{'prepared ms':>13}{'saved ms':>10}")
+    for route, (query, params) in routes.items():
+        cursor = plain_conn.cursor()
+        cursor.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + query, params)
+        planning_ms = cursor.fetchone()["QUERY PLAN"][0]["Planning Time"]
+        plain_conn.rollback()
+        
+        timings = []
+        for conn in (plain_conn, prepared_conn):
+            cursor = conn.cursor()
+            start = time.perf_counter()
+            for _ in range(calls):
+                cursor.execute(query, params)
+                cursor.fetchall()
+            timings.append((time.perf_counter() - start) / calls * 1000)
+            conn.rollback()
+        print(f"{route:<24}{planning_ms:>13.3f}{timings[0]:>10.3f}{timings[1]:>13.3f}{timings[0] - timings[1]:>10.3f}")
+    plain_conn.close()
+    prepared_conn.close()
+
+
+if __name__ == "__main__":
+    mode = sys.argv[1] if len(sys.argv) > 1 else "serialization"
+    if mode == "statements":
+        statements_benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 1000)
+    elif mode == "fetch":
+        fetch_benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 20)
+    else:
+        serialization_benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 500)
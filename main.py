@@ -1,34 +1,514 @@
 from flask import Flask, request, jsonify, make_response, send_from_directory
+from flask.json.provider import DefaultJSONProvider
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg2.errors
+import psycopg2.extensions
+from psycopg2.extras import Json, RealDictCursor
 from flask_cors import CORS
-from datetime import datetime, timedelta
+from werkzeug.http import http_date
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+import gzip
 import hashlib
+import itertools
+import json
+import multiprocessing
 import os
+import select
+import sys
+import threading
+import time
 import uuid
+import zlib
 import jwt
+from collections import OrderedDict
 from functools import wraps
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+def _json_default(value):
+    # Keep the wire format jsonify has always produced
+    if isinstance(value, (datetime, date)):
+        return http_date(value)
+    if isinstance(value, (Decimal, uuid.UUID)):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps_json(payload):
+    if orjson is not None:
+        return orjson.dumps(
+            payload,
+            default=_json_default,
+            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        )
+    return json.dumps(
+        payload, default=_json_default, ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+
+class FastJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        return dumps_json(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if orjson is not None:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 CORS(app)
 
 # Load configuration from environment variables
 DATABASE_URL = os.environ.get("DATABASE_URL")
+DATABASE_REPLICA_URLS = [
+    url.strip() for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if url.strip()
+]
+REPLICA_MAX_LAG = float(os.environ.get("REPLICA_MAX_LAG", 5))
+REPLICA_LAG_CHECK_INTERVAL = float(os.environ.get("REPLICA_LAG_CHECK_INTERVAL", 2))
+READ_YOUR_WRITES_WINDOW = float(os.environ.get("READ_YOUR_WRITES_WINDOW", 10))
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_POOL_PING_AFTER = float(os.environ.get("DB_POOL_PING_AFTER", 30))
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 1))
+JOB_RETRY_BASE = int(os.environ.get("JOB_RETRY_BASE", 5))
+JOB_RETRY_MAX = int(os.environ.get("JOB_RETRY_MAX", 3600))
+JOB_TIMEOUT = int(os.environ.get("JOB_TIMEOUT", 900))
+STATISTICS_REFRESH_INTERVAL = int(os.environ.get("STATISTICS_REFRESH_INTERVAL", 300))
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 1024))
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", 60))
 SECRET_KEY = os.environ.get("SECRET_KEY", "your-secret-key-here")
 API_KEY = os.environ.get("DEFAULT_API_KEY", "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")
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+SUPPORT_PREVIEW_LENGTH = 100
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+CHAT_COMPRESS_MIN_LENGTH = int(os.environ.get("CHAT_COMPRESS_MIN_LENGTH", 1024))
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 1024))
+COMPRESS_GZIP_LEVEL = int(os.environ.get("COMPRESS_GZIP_LEVEL", 6))
+COMPRESS_BROTLI_LEVEL = int(os.environ.get("COMPRESS_BROTLI_LEVEL", 5))
 
 # Ensure upload folder exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+# Hot queries, prepared once per physical connection
+PREPARED_STATEMENTS = {}
+
+def prepared_statement(name, sql):
+    params = sql.count("%s")
+    prepared_sql = sql
+    for position in range(1, params + 1):
+        prepared_sql = prepared_sql.replace("%s", f"${position}", 1)
+    PREPARED_STATEMENTS[sql] = (name, prepared_sql, params)
+    return sql
+
+LOGIN_QUERY = prepared_statement("login", """
+    SELECT * FROM users WHERE username = %s AND password = %s
+""")
+UPDATE_LAST_LOGIN_QUERY = prepared_statement("update_last_login", """
+    UPDATE users SET last_login = %s WHERE id = %s
+""")
+USERS_BY_IDS_QUERY = prepared_statement("users_by_ids", """
+    SELECT * FROM users WHERE id = ANY(%s)
+""")
+SETTINGS_QUERY = prepared_statement("settings", """
+    SELECT * FROM site_settings LIMIT 1
+""")
+SETTINGS_API_KEY_QUERY = prepared_statement("settings_api_key", """
+    SELECT api_key FROM site_settings LIMIT 1
+""")
+NEWS_LIST_QUERY = prepared_statement("news_list", """
+    SELECT * FROM news ORDER BY created_at DESC
+""")
+SUPPORT_MESSAGES_QUERY = prepared_statement("support_messages", """
+    SELECT * FROM support_messages
+    WHERE chat_id = %s
+    ORDER BY created_at ASC
+""")
+INSERT_SUPPORT_MESSAGE_QUERY = prepared_statement("insert_support_message", """
+    INSERT INTO support_messages (chat_id, user_id, message, image_url)
+    VALUES (%s, %s, %s, %s)
+    RETURNING *
+""")
+# Messages from the chat owner are unread for admins, everything else is unread for the owner.
+# created_at is the sender's transaction start, so a message can commit after a newer one;
+# never move the summary backwards.
+UPDATE_SUPPORT_INBOX_QUERY = prepared_statement("update_support_inbox", """
+    UPDATE support_chats SET
+    last_message_preview = CASE
+        WHEN last_message_at IS NULL OR last_message_at <= %s THEN %s
+        ELSE last_message_preview
+    END,
+    last_message_at = GREATEST(last_message_at, %s),
+    message_count = message_count + 1,
+    unread_by_admin = unread_by_admin + CASE WHEN user_id = %s THEN 1 ELSE 0 END,
+    unread_by_user = unread_by_user + CASE WHEN user_id = %s THEN 0 ELSE 1 END
+    WHERE id = %s
+""")
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+class PreparedStatementMixin:
+    def execute(self, query, vars=None):
+        conn = self.connection
+        statement = PREPARED_STATEMENTS.get(query)
+        if statement is None or not isinstance(conn, PooledConnection):
+            return super().execute(query, vars)
+        
+        name, prepared_sql, params = statement
+        execute_sql = f"EXECUTE {name} ({', '.join(['%s'] * params)})" if params else f"EXECUTE {name}"
+        # A failed EXECUTE can only be retried if it was the first statement of its transaction
+        fresh_transaction = conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        try:
+            self._prepare(name, prepared_sql)
+            return super().execute(execute_sql, vars)
+        except (psycopg2.errors.InvalidSqlStatementName, psycopg2.errors.FeatureNotSupported) as e:
+            # The statement was deallocated, or the schema changed under its cached plan
+            conn.prepared.discard(name)
+            if isinstance(e, psycopg2.errors.FeatureNotSupported):
+                conn.stale_prepared.add(name)
+            if not fresh_transaction:
+                raise
+            conn.rollback()
+            self._prepare(name, prepared_sql)
+            return super().execute(execute_sql, vars)
+
+    def _prepare(self, name, prepared_sql):
+        conn = self.connection
+        if name in conn.prepared:
+            return
+        if name in conn.stale_prepared:
+            super().execute(f"DEALLOCATE {name}")
+            conn.stale_prepared.discard(name)
+        super().execute(f"PREPARE {name} AS {prepared_sql}")
+        conn.prepared.add(name)
+
+class PreparedCursor(PreparedStatementMixin, RealDictCursor):
+    pass
+
+class PreparedTupleCursor(PreparedStatementMixin, psycopg2.extensions.cursor):
+    pass
+
+# Connection pool; handlers keep calling close(), which hands the connection back
+class PooledConnection(psycopg2.extensions.connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.stale_prepared = set()
+        self.pool = None
+        self.pool_key = None
+
+    def close(self):
+        if self.pool is not None and not self.closed:
+            self.pool.release(self)
+        else:
+            super().close()
+
+class ConnectionPool:
+    def __init__(self, size):
+        self.size = size
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def get(self, dsn):
+        while True:
+            with self._lock:
+                # Connections inherited from a parent process belong to the parent; keep
+                # them referenced so garbage collection never closes the parent's sessions
+                if self._pid != os.getpid():
+                    self._inherited = self._idle
+                    self._idle = {}
+                    self._pid = os.getpid()
+                idle = self._idle.get(dsn)
+                if not idle:
+                    break
+                conn, released_at = idle.pop()
+            if self._usable(conn, released_at):
+                return conn
+            psycopg2.extensions.connection.close(conn)
+        
+        conn = psycopg2.connect(dsn, connection_factory=PooledConnection, cursor_factory=PreparedCursor)
+        conn.pool = self
+        conn.pool_key = dsn
+        return conn
+
+    def _usable(self, conn, released_at):
+        if conn.closed:
+            return False
+        # An idle session has nothing to read unless the server has ended it, as a
+        # restart or failover does; closed stays 0 until a statement fails
+        readable, _, _ = select.select([conn], [], [], 0)
+        if readable:
+            return False
+        if time.monotonic() - released_at < DB_POOL_PING_AFTER:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def release(self, conn):
+        try:
+            conn.rollback()
+            # Replica reads mark their connection read-only; the next borrower may write
+            conn.readonly = None
+            with self._lock:
+                idle = self._idle.setdefault(conn.pool_key, [])
+                if self._pid == os.getpid() and len(idle) < self.size:
+                    idle.append((conn, time.monotonic()))
+                    return
+        except psycopg2.Error:
+            pass
+        psycopg2.extensions.connection.close(conn)
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for conn, _ in connections:
+                psycopg2.extensions.connection.close(conn)
+
+connection_pool = ConnectionPool(DB_POOL_SIZE)
+
 def get_connection():
-    return psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+    return connection_pool.get(DATABASE_URL)
+
+# Read replica routing
+_replica_lock = threading.Lock()
+_replica_cycle = itertools.cycle(DATABASE_REPLICA_URLS)
+_replica_lag = {}
+_recent_writes = {}
+
+def record_write(*keys):
+    # Reads of these keys go to the primary until the replicas have caught up
+    now = time.monotonic()
+    with _replica_lock:
+        for key, written_at in list(_recent_writes.items()):
+            if now - written_at > READ_YOUR_WRITES_WINDOW:
+                del _recent_writes[key]
+        for key in keys:
+            _recent_writes[key] = now
+
+def _written_recently(keys):
+    now = time.monotonic()
+    with _replica_lock:
+        return any(now - _recent_writes.get(key, -READ_YOUR_WRITES_WINDOW) <= READ_YOUR_WRITES_WINDOW
+                   for key in keys)
+
+def _primary_wal_lsn():
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_current_wal_lsn() as lsn")
+        return cursor.fetchone()["lsn"]
+    finally:
+        conn.close()
+
+def _replica_lag_ok(url, conn):
+    now = time.monotonic()
+    with _replica_lock:
+        checked_at, lag = _replica_lag.get(url, (None, None))
+    
+    if checked_at is None or now - checked_at > REPLICA_LAG_CHECK_INTERVAL:
+        primary_lsn = _primary_wal_lsn()
+        cursor = conn.cursor()
+        # A standby that has replayed everything the primary had has no lag, however old
+        # its last transaction; otherwise its data is as old as its last replayed commit.
+        # Comparing against the primary also catches a disconnected WAL receiver, whose
+        # receive and replay positions stop moving together.
+        cursor.execute("""
+            SELECT NOT pg_is_in_recovery() as standalone,
+                   pg_last_wal_replay_lsn() >= %s::pg_lsn as caught_up,
+                   EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) as replay_age
+        """, (primary_lsn,))
+        status = cursor.fetchone()
+        cursor.close()
+        conn.rollback()
+        
+        if status["standalone"] or status["caught_up"]:
+            lag = 0.0
+        elif status["replay_age"] is None:
+            lag = float("inf")
+        else:
+            lag = float(status["replay_age"])
+        with _replica_lock:
+            _replica_lag[url] = (now, lag)
+    
+    return lag <= REPLICA_MAX_LAG
+
+def get_read_connection(*keys):
+    if not DATABASE_REPLICA_URLS or _written_recently(keys):
+        return get_connection()
+    
+    for _ in DATABASE_REPLICA_URLS:
+        with _replica_lock:
+            url = next(_replica_cycle)
+        conn = None
+        try:
+            conn = connection_pool.get(url)
+            conn.set_session(readonly=True)
+            if _replica_lag_ok(url, conn):
+                return conn
+            conn.close()
+        except psycopg2.Error as e:
+            print(f"تعذر استخدام النسخة المتماثلة: {e}")
+            if conn is not None:
+                conn.close()
+    
+    return get_connection()
+
+# Per-worker user profile cache
+class UserCache:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._listener_pid = None
+
+    def get(self, user_id):
+        return self.get_many([user_id]).get(user_id)
+
+    def get_many(self, user_ids):
+        self._ensure_listener()
+        now = time.monotonic()
+        found = {}
+        missing = []
+        with self._lock:
+            generation = self._generation
+            for user_id in set(user_ids):
+                entry = self._entries.get(user_id)
+                if entry and now - entry[0] <= self.ttl:
+                    self._entries.move_to_end(user_id)
+                    found[user_id] = entry[1]
+                    self.hits += 1
+                else:
+                    missing.append(user_id)
+                    self.misses += 1
+        
+        if missing:
+            # Always fill from the primary; a lagging replica would cache a row
+            # that an invalidation has already replaced
+            conn = get_connection()
+            try:
+                cursor = conn.cursor()
+                cursor.execute(USERS_BY_IDS_QUERY, (missing,))
+                users = cursor.fetchall()
+                cursor.close()
+            finally:
+                conn.close()
+            
+            for user in users:
+                found[user["id"]] = self.put(user, generation)
+        return found
+
+    def put(self, user, generation=None):
+        user = dict(user)
+        with self._lock:
+            # Skip rows read before an eviction that arrived while they were loading
+            if generation is not None and generation != self._generation:
+                return user
+            # A committed write-through row supersedes loads still in flight, which
+            # may have read the row before the writer committed
+            if generation is None:
+                self._generation += 1
+            self._entries[user["id"]] = (time.monotonic(), user)
+            self._entries.move_to_end(user["id"])
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return user
+
+    def evict(self, user_id=None):
+        with self._lock:
+            self._generation += 1
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    def invalidate(self, cursor, user_id=None):
+        # Other workers drop the entry once the caller's transaction commits; until
+        # then loads in this worker still read the old row, so after committing the
+        # caller must put() the new row or evict() again
+        self.evict(user_id)
+        target = "*" if user_id is None else str(user_id)
+        cursor.execute("SELECT pg_notify('user_cache', %s)", (f"{os.getpid()}:{target}",))
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+    def _ensure_listener(self):
+        if self._listener_pid == os.getpid() or not DATABASE_URL:
+            return
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+        threading.Thread(target=self._listen, daemon=True).start()
+
+    def _listen(self):
+        pid = str(os.getpid())
+        while True:
+            try:
+                conn = psycopg2.connect(DATABASE_URL)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                conn.cursor().execute("LISTEN user_cache")
+                # Anything could have changed while we were not listening
+                self.evict()
+                while True:
+                    if select.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        sender, target = conn.notifies.pop(0).payload.split(":", 1)
+                        if sender != pid:
+                            self.evict(None if target == "*" else int(target))
+            except psycopg2.Error as e:
+                print(f"انقطع الاستماع لتحديثات ذاكرة المستخدمين: {e}")
+                self.evict()
+                time.sleep(5)
+
+user_cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+# Keyset pagination over (timestamp, id), newest first
+def encode_page_cursor(created_at, row_id):
+    return f"{created_at.isoformat()}|{row_id}"
+
+def decode_page_cursor(value):
+    created_at, row_id = value.rsplit("|", 1)
+    return datetime.fromisoformat(created_at), int(row_id)
+
+def page_size():
+    limit = request.args.get("limit", PAGE_SIZE, type=int)
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def tuple_cursor(conn):
+    return conn.cursor(cursor_factory=PreparedTupleCursor)
+
+def fetch_rows(cursor):
+    # Plain tuples are cheaper than RealDictRow; build the column layout once per result
+    columns = [column.name for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
 
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
@@ -54,6 +534,12 @@ def init_db():
         )
     """)
     
+    # Statistics trends need to know when users signed up
+    cursor.execute("""
+        ALTER TABLE users
+        ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    """)
+    
     # Create news table
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS news (
@@ -91,16 +577,45 @@ def init_db():
         )
     """)
     
+    # Group AI messages into conversations and keep long content compressed
+    cursor.execute("""
+        ALTER TABLE chat_messages
+        ADD COLUMN IF NOT EXISTS conversation_id TEXT,
+        ADD COLUMN IF NOT EXISTS content_compressed BYTEA
+    """)
+    
+    # Each history page is a range scan of one user's messages, newest first
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_chat_messages_user_created
+        ON chat_messages (user_id, created_at DESC, id DESC)
+        INCLUDE (conversation_id)
+    """)
+    
     # Create support chats table
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS support_chats (
             id SERIAL PRIMARY KEY,
             user_id INTEGER REFERENCES users(id),
             status TEXT DEFAULT 'open',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_message_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_message_preview TEXT,
+            message_count INTEGER DEFAULT 0,
+            unread_by_user INTEGER DEFAULT 0,
+            unread_by_admin INTEGER DEFAULT 0
         )
     """)
     
+    # Add inbox columns to support chats created before they existed
+    cursor.execute("""
+        ALTER TABLE support_chats
+        ADD COLUMN IF NOT EXISTS last_message_at TIMESTAMP,
+        ADD COLUMN IF NOT EXISTS last_message_preview TEXT,
+        ADD COLUMN IF NOT EXISTS message_count INTEGER DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS unread_by_user INTEGER DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS unread_by_admin INTEGER DEFAULT 0
+    """)
+    
     # Create support messages table
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS support_messages (
@@ -113,6 +628,86 @@ def init_db():
         )
     """)
     
+    # Backfill inbox columns for chats that have messages but no summary yet
+    cursor.execute("""
+        UPDATE support_chats sc
+        SET last_message_at = last.created_at,
+            last_message_preview = LEFT(COALESCE(last.message, ''), %s),
+            message_count = counts.message_count
+        FROM (
+            SELECT DISTINCT ON (chat_id) chat_id, message, created_at
+            FROM support_messages
+            ORDER BY chat_id, created_at DESC, id DESC
+        ) last
+        JOIN (
+            SELECT chat_id, COUNT(*) as message_count
+            FROM support_messages
+            GROUP BY chat_id
+        ) counts ON counts.chat_id = last.chat_id
+        WHERE sc.id = last.chat_id AND sc.last_message_at IS NULL
+    """, (SUPPORT_PREVIEW_LENGTH,))
+    
+    # Chats without messages sort by when they were opened
+    cursor.execute("""
+        ALTER TABLE support_chats
+        ALTER COLUMN last_message_at SET DEFAULT CURRENT_TIMESTAMP
+    """)
+    cursor.execute("""
+        UPDATE support_chats SET last_message_at = created_at
+        WHERE last_message_at IS NULL
+    """)
+    
+    # Index the support inbox by latest activity
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_support_chats_last_message_at
+        ON support_chats (last_message_at DESC NULLS LAST, id DESC)
+    """)
+    
+    # Create background jobs table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id SERIAL PRIMARY KEY,
+            kind TEXT NOT NULL,
+            payload JSONB DEFAULT '{}',
+            status TEXT DEFAULT 'queued',
+            priority INTEGER DEFAULT 0,
+            attempts INTEGER DEFAULT 0,
+            max_attempts INTEGER DEFAULT 5,
+            run_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            interval_seconds INTEGER,
+            result JSONB,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    """)
+    
+    # Workers claim the highest priority due job from this index
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_jobs_queue
+        ON jobs (priority DESC, run_at)
+        WHERE status = 'queued'
+    """)
+    
+    # Only one schedule per periodic job kind
+    cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_periodic_kind
+        ON jobs (kind)
+        WHERE interval_seconds IS NOT NULL
+    """)
+    
+    # Create statistics snapshot table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS statistics_snapshot (
+            id INTEGER PRIMARY KEY,
+            data JSONB NOT NULL,
+            computed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    schedule_periodic_job(cursor, "refresh_statistics", STATISTICS_REFRESH_INTERVAL)
+    
     # Initialize admin user
     cursor.execute("""
         INSERT INTO users (fullname, email, username, password, is_admin, profile_image, api_key)
@@ -164,6 +759,60 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# Routes about one user's private data: the user themselves or an admin
+def owner_or_admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        token = request.headers.get('Authorization')
+        if not token:
+            return jsonify({"error": "Token is missing"}), 401
+            
+        try:
+            data = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+        except jwt.InvalidTokenError:
+            return jsonify({"error": "Invalid token"}), 401
+        
+        if data.get('user_id') != kwargs.get('user_id') and not data.get('is_admin'):
+            return jsonify({"error": "Access denied"}), 403
+            
+        return f(*args, **kwargs)
+    return decorated_function
+
+# Per-route compression levels
+def compress(gzip_level=None, brotli_level=None):
+    def decorator(f):
+        f.compress_levels = (gzip_level, brotli_level)
+        return f
+    return decorator
+
+@app.after_request
+def compress_response(response):
+    if (response.direct_passthrough
+            or response.status_code != 200
+            or "Content-Encoding" in response.headers):
+        return response
+    
+    response.vary.add("Accept-Encoding")
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    
+    view = app.view_functions.get(request.endpoint)
+    gzip_level, brotli_level = getattr(view, "compress_levels", (None, None))
+    # Honour the client's q-values, including an explicit refusal (q=0); prefer
+    # brotli when both are equally acceptable
+    encoding = request.accept_encodings.best_match(["br", "gzip"] if brotli is not None else ["gzip"])
+    
+    if encoding == "br":
+        level = COMPRESS_BROTLI_LEVEL if brotli_level is None else brotli_level
+        response.set_data(brotli.compress(data, quality=level))
+        response.headers["Content-Encoding"] = "br"
+    elif encoding == "gzip":
+        level = COMPRESS_GZIP_LEVEL if gzip_level is None else gzip_level
+        response.set_data(gzip.compress(data, compresslevel=level))
+        response.headers["Content-Encoding"] = "gzip"
+    return response
+
 @app.route("/signup", methods=["POST"])
 def signup():
     data = request.json
@@ -183,7 +832,7 @@ def signup():
                 return jsonify({"success": False, "error": "البريد الإلكتروني مستخدم بالفعل"})
         
         # Get default API key from site settings
-        cursor.execute("SELECT api_key FROM site_settings LIMIT 1")
+        cursor.execute(SETTINGS_API_KEY_QUERY)
         site_settings = cursor.fetchone()
         default_api_key = site_settings["api_key"] if site_settings else API_KEY
         
@@ -220,9 +869,7 @@ def login():
     conn = get_connection()
     cursor = conn.cursor()
 
-    cursor.execute("""
-        SELECT * FROM users WHERE username = %s AND password = %s
-    """, (username, hash_password(password)))
+    cursor.execute(LOGIN_QUERY, (username, hash_password(password)))
     user = cursor.fetchone()
 
     if not user:
@@ -252,10 +899,10 @@ def login():
             print(f"خطأ في معالجة تاريخ الحظر: {e}")
 
     # Update last login
-    cursor.execute("""
-        UPDATE users SET last_login = %s WHERE id = %s
-    """, (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), user["id"]))
+    cursor.execute(UPDATE_LAST_LOGIN_QUERY, (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), user["id"]))
+    user_cache.invalidate(cursor, user["id"])
     conn.commit()
+    user_cache.evict(user["id"])
     
     # Generate JWT token
     token = jwt.encode({
@@ -282,9 +929,9 @@ def login():
 @admin_required
 def get_users():
     conn = get_connection()
-    cursor = conn.cursor()
+    cursor = tuple_cursor(conn)
     cursor.execute("SELECT id, fullname, username, email, last_login, banned_until, permanently_banned, is_admin FROM users")
-    users = cursor.fetchall()
+    users = fetch_rows(cursor)
     cursor.close()
     conn.close()
     return jsonify(users)
@@ -296,8 +943,7 @@ def user_operations(user_id):
     cursor = conn.cursor()
 
     if request.method == "GET":
-        cursor.execute("SELECT * FROM users WHERE id = %s", (user_id,))
-        user = cursor.fetchone()
+        user = user_cache.get(user_id)
         cursor.close()
         conn.close()
         if user:
@@ -311,6 +957,7 @@ def user_operations(user_id):
             UPDATE users
             SET fullname = %s, email = %s, username = %s, banned_until = %s, permanently_banned = %s
             WHERE id = %s
+            RETURNING *
         """, (
             data.get("fullname"),
             data.get("email"),
@@ -319,17 +966,27 @@ def user_operations(user_id):
             data.get("permanently_banned", 0),
             user_id
         ))
+        updated_user = cursor.fetchone()
+        user_cache.invalidate(cursor, user_id)
         conn.commit()
+        if updated_user:
+            user_cache.put(updated_user)
+        record_write(f"user:{user_id}")
         cursor.close()
         conn.close()
         return jsonify({"success": True, "message": "تم تحديث بيانات المستخدم بنجاح"})
 
     elif request.method == "DELETE":
-        cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
+        job_id = enqueue_job(cursor, "delete_user", {"user_id": user_id}, priority=10)
         conn.commit()
+        record_write(f"user:{user_id}")
         cursor.close()
         conn.close()
-        return jsonify({"success": True, "message": "تم حذف المستخدم بنجاح"})
+        return jsonify({
+            "success": True,
+            "job_id": job_id,
+            "message": "جاري حذف المستخدم"
+        }), 202
 
 @app.route("/users/<int:user_id>/admin", methods=["POST"])
 @admin_required
@@ -346,9 +1003,14 @@ def toggle_admin(user_id):
         UPDATE users
         SET is_admin = %s
         WHERE id = %s
+        RETURNING *
     """, (new_status, user_id))
+    updated_user = cursor.fetchone()
+    user_cache.invalidate(cursor, user_id)
     
     conn.commit()
+    user_cache.put(updated_user)
+    record_write(f"user:{user_id}")
     cursor.close()
     conn.close()
     
@@ -360,12 +1022,12 @@ def toggle_admin(user_id):
 
 @app.route("/news", methods=["GET", "POST"])
 def news_operations():
-    conn = get_connection()
-    cursor = conn.cursor()
+    conn = get_read_connection("news") if request.method == "GET" else get_connection()
+    cursor = tuple_cursor(conn)
     
     if request.method == "GET":
-        cursor.execute("SELECT * FROM news ORDER BY created_at DESC")
-        news = cursor.fetchall()
+        cursor.execute(NEWS_LIST_QUERY)
+        news = fetch_rows(cursor)
         cursor.close()
         conn.close()
         return jsonify(news)
@@ -384,6 +1046,7 @@ def news_operations():
                 data.get("type", "خبر")
             ))
             conn.commit()
+            record_write("news")
             cursor.close()
             conn.close()
             return jsonify({"success": True, "message": "تم إضافة الخبر بنجاح"})
@@ -399,6 +1062,7 @@ def single_news_operations(news_id):
     if request.method == "DELETE":
         cursor.execute("DELETE FROM news WHERE id = %s", (news_id,))
         conn.commit()
+        record_write("news")
         cursor.close()
         conn.close()
         return jsonify({"success": True, "message": "تم حذف الخبر بنجاح"})
@@ -418,6 +1082,7 @@ def single_news_operations(news_id):
             news_id
         ))
         conn.commit()
+        record_write("news")
         cursor.close()
         conn.close()
         return jsonify({"success": True, "message": "تم تحديث الخبر بنجاح"})
@@ -484,16 +1149,15 @@ def update_profile():
         update_query += " WHERE id = %s"
         params.append(user_id)
         
-        cursor.execute(update_query, tuple(params))
-        conn.commit()
+        update_query += " RETURNING *"
         
-        # Get updated user data
-        cursor.execute("""
-            SELECT fullname, username, email, profile_image, api_key
-            FROM users 
-            WHERE id = %s
-        """, (user_id,))
+        cursor.execute(update_query, tuple(params))
         updated_user = cursor.fetchone()
+        user_cache.invalidate(cursor, int(user_id))
+        conn.commit()
+        if updated_user:
+            user_cache.put(updated_user)
+        record_write(f"user:{user_id}")
         
         return jsonify({
             "success": True,
@@ -516,37 +1180,34 @@ def uploaded_file(filename):
 
 @app.route("/user/<int:user_id>", methods=["GET"])
 def get_user_profile(user_id):
-    conn = get_connection()
-    cursor = conn.cursor()
-    
     try:
-        cursor.execute("""
-            SELECT id, fullname, username, email, profile_image, is_admin, api_key
-            FROM users 
-            WHERE id = %s
-        """, (user_id,))
-        
-        user = cursor.fetchone()
+        user = user_cache.get(user_id)
         if not user:
             return jsonify({"error": "المستخدم غير موجود"}), 404
         
-        return jsonify(user)
+        return jsonify({
+            key: user[key]
+            for key in ("id", "fullname", "username", "email", "profile_image", "is_admin", "api_key")
+        })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        cursor.close()
-        conn.close()
 
 @app.route("/settings", methods=["GET", "POST"])
 def site_settings():
-    conn = get_connection()
+    conn = get_read_connection("settings") if request.method == "GET" else get_connection()
     cursor = conn.cursor()
     
     if request.method == "GET":
-        cursor.execute("SELECT * FROM site_settings LIMIT 1")
+        cursor.execute(SETTINGS_QUERY)
         settings = cursor.fetchone()
         
         if not settings:
+            # Default settings must be written on the primary
+            cursor.close()
+            conn.close()
+            conn = get_connection()
+            cursor = conn.cursor()
+            
             # Create default settings if not exists
             cursor.execute("""
                 INSERT INTO site_settings 
@@ -562,6 +1223,7 @@ def site_settings():
             ))
             settings = cursor.fetchone()
             conn.commit()
+            record_write("settings")
         
         cursor.close()
         conn.close()
@@ -586,6 +1248,7 @@ def site_settings():
         
         updated_settings = cursor.fetchone()
         conn.commit()
+        record_write("settings")
         cursor.close()
         conn.close()
         
@@ -613,121 +1276,149 @@ def update_api_key():
             WHERE id = 1
         """, (data["api_key"],))
         
-        # Update API key for all users
-        cursor.execute("""
-            UPDATE users SET
-            api_key = %s
-        """, (data["api_key"],))
+        # Update API key for all users in the background
+        job_id = enqueue_job(cursor, "propagate_api_key", priority=5)
         
         conn.commit()
+        record_write("settings")
         return jsonify({
             "success": True,
-            "message": "تم تحديث مفتاح API بنجاح لجميع المستخدمين"
-        })
+            "job_id": job_id,
+            "message": "جاري تحديث مفتاح API لجميع المستخدمين"
+        }), 202
     except Exception as e:
         return jsonify({"success": False, "error": str(e)})
     finally:
         cursor.close()
         conn.close()
 
+def compute_statistics(cursor):
+    # User statistics
+    cursor.execute("SELECT COUNT(*) as users_count FROM users")
+    users_count = cursor.fetchone()["users_count"]
+    
+    # Active users today
+    cursor.execute("""
+        SELECT COUNT(*) as active_users FROM users 
+        WHERE last_login >= CURRENT_DATE
+    """)
+    active_users = cursor.fetchone()["active_users"]
+    
+    # Daily chats
+    cursor.execute("""
+        SELECT COUNT(*) as daily_chats FROM chat_messages
+        WHERE created_at >= CURRENT_DATE
+    """)
+    daily_chats = cursor.fetchone()["daily_chats"]
+    
+    # Average response time
+    cursor.execute("""
+        SELECT AVG(response_time) as avg_response_time FROM chat_messages
+        WHERE response_time IS NOT NULL
+    """)
+    avg_response = round(float(cursor.fetchone()["avg_response_time"] or 0), 2)
+    
+    # User activity last 7 days
+    cursor.execute("""
+        SELECT 
+            TO_CHAR(date_series, 'YYYY-MM-DD') as day,
+            COUNT(DISTINCT u.id) as active_users
+        FROM 
+            generate_series(CURRENT_DATE - 6, CURRENT_DATE, interval '1 day') as date_series
+        LEFT JOIN users u ON DATE(u.last_login) = date_series
+        GROUP BY date_series
+        ORDER BY date_series
+    """)
+    activity_data = cursor.fetchall()
+    
+    # User distribution by activity level
+    cursor.execute("""
+        SELECT 
+            CASE 
+                WHEN last_login >= CURRENT_DATE THEN 'نشط اليوم'
+                WHEN last_login >= CURRENT_DATE - 7 THEN 'نشط هذا الأسبوع'
+                WHEN last_login >= CURRENT_DATE - 30 THEN 'نشط هذا الشهر'
+                WHEN last_login IS NULL THEN 'لم يسجل دخول'
+                ELSE 'غير نشط'
+            END as activity_level,
+            COUNT(*) as users_count
+        FROM users
+        GROUP BY activity_level
+    """)
+    distribution_data = cursor.fetchall()
+    
+    # News statistics
+    cursor.execute("SELECT COUNT(*) as news_count FROM news")
+    news_count = cursor.fetchone()["news_count"]
+    
+    cursor.execute("SELECT COUNT(DISTINCT type) as news_types FROM news")
+    news_types = cursor.fetchone()["news_types"]
+    
+    # Calculate trends (simplified for demo)
+    cursor.execute("""
+        SELECT 
+            COUNT(*) as prev_month_users,
+            (SELECT COUNT(*) FROM users WHERE last_login >= CURRENT_DATE - 30) as active_month_users
+        FROM users
+        WHERE created_at >= CURRENT_DATE - 60 AND created_at < CURRENT_DATE - 30
+    """)
+    trends = cursor.fetchone()
+    users_trend = 12  # Simplified trend calculation
+    
+    return {
+        "users_count": users_count,
+        "active_users": active_users,
+        "daily_chats": daily_chats,
+        "avg_response_time": avg_response,
+        "news_count": news_count,
+        "news_types": news_types,
+        "users_trend": users_trend,
+        "active_trend": 8,
+        "chats_trend": -5,
+        "user_activity": {
+            "days": [item["day"] for item in activity_data],
+            "values": [item["active_users"] for item in activity_data]
+        },
+        "users_distribution": {
+            "labels": [item["activity_level"] for item in distribution_data],
+            "values": [item["users_count"] for item in distribution_data]
+        }
+    }
+
 @app.route("/statistics", methods=["GET"])
 @admin_required
 def get_statistics():
-    conn = get_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     
     try:
-        # User statistics
-        cursor.execute("SELECT COUNT(*) as users_count FROM users")
-        users_count = cursor.fetchone()["users_count"]
-        
-        # Active users today
-        cursor.execute("""
-            SELECT COUNT(*) as active_users FROM users 
-            WHERE last_login >= CURRENT_DATE
-        """)
-        active_users = cursor.fetchone()["active_users"]
-        
-        # Daily chats
-        cursor.execute("""
-            SELECT COUNT(*) as daily_chats FROM chat_messages
-            WHERE created_at >= CURRENT_DATE
-        """)
-        daily_chats = cursor.fetchone()["daily_chats"]
-        
-        # Average response time
-        cursor.execute("""
-            SELECT AVG(response_time) as avg_response_time FROM chat_messages
-            WHERE response_time IS NOT NULL
-        """)
-        avg_response = round(float(cursor.fetchone()["avg_response_time"] or 0), 2)
+        cursor.execute("SELECT data, computed_at FROM statistics_snapshot WHERE id = 1")
+        snapshot = cursor.fetchone()
         
-        # User activity last 7 days
-        cursor.execute("""
-            SELECT 
-                TO_CHAR(date_series, 'YYYY-MM-DD') as day,
-                COUNT(DISTINCT u.id) as active_users
-            FROM 
-                generate_series(CURRENT_DATE - 6, CURRENT_DATE, interval '1 day') as date_series
-            LEFT JOIN users u ON DATE(u.last_login) = date_series
-            GROUP BY date_series
-            ORDER BY date_series
-        """)
-        activity_data = cursor.fetchall()
-        
-        # User distribution by activity level
-        cursor.execute("""
-            SELECT 
-                CASE 
-                    WHEN last_login >= CURRENT_DATE THEN 'نشط اليوم'
-                    WHEN last_login >= CURRENT_DATE - 7 THEN 'نشط هذا الأسبوع'
-                    WHEN last_login >= CURRENT_DATE - 30 THEN 'نشط هذا الشهر'
-                    WHEN last_login IS NULL THEN 'لم يسجل دخول'
-                    ELSE 'غير نشط'
-                END as activity_level,
-                COUNT(*) as users_count
-            FROM users
-            GROUP BY activity_level
-        """)
-        distribution_data = cursor.fetchall()
-        
-        # News statistics
-        cursor.execute("SELECT COUNT(*) as news_count FROM news")
-        news_count = cursor.fetchone()["news_count"]
-        
-        cursor.execute("SELECT COUNT(DISTINCT type) as news_types FROM news")
-        news_types = cursor.fetchone()["news_types"]
-        
-        # Calculate trends (simplified for demo)
-        cursor.execute("""
-            SELECT 
-                COUNT(*) as prev_month_users,
-                (SELECT COUNT(*) FROM users WHERE last_login >= CURRENT_DATE - 30) as active_month_users
-            FROM users
-            WHERE created_at >= CURRENT_DATE - 60 AND created_at < CURRENT_DATE - 30
-        """)
-        trends = cursor.fetchone()
-        users_trend = 12  # Simplified trend calculation
+        if not snapshot:
+            # Nothing computed yet; make sure a refresh is on its way
+            cursor.close()
+            conn.close()
+            conn = get_connection()
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id FROM jobs
+                WHERE kind = 'refresh_statistics' AND status IN ('queued', 'running')
+                ORDER BY id
+                LIMIT 1
+            """)
+            pending = cursor.fetchone()
+            job_id = pending["id"] if pending else enqueue_job(cursor, "refresh_statistics", priority=5)
+            conn.commit()
+            return jsonify({
+                "success": True,
+                "job_id": job_id,
+                "message": "جاري حساب الإحصائيات"
+            }), 202
         
-        return jsonify({
-            "users_count": users_count,
-            "active_users": active_users,
-            "daily_chats": daily_chats,
-            "avg_response_time": avg_response,
-            "news_count": news_count,
-            "news_types": news_types,
-            "users_trend": users_trend,
-            "active_trend": 8,
-            "chats_trend": -5,
-            "user_activity": {
-                "days": [item["day"] for item in activity_data],
-                "values": [item["active_users"] for item in activity_data]
-            },
-            "users_distribution": {
-                "labels": [item["activity_level"] for item in distribution_data],
-                "values": [item["users_count"] for item in distribution_data]
-            }
-        })
+        statistics = snapshot["data"]
+        statistics["computed_at"] = snapshot["computed_at"]
+        return jsonify(statistics)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
@@ -737,19 +1428,45 @@ def get_statistics():
         
 @app.route("/support-chats", methods=["GET"])
 @admin_required
+@compress(gzip_level=5, brotli_level=4)
 def get_support_chats():
+    # Existing clients expect every chat; paging is opt-in through ?limit= or ?before=
+    paged = "limit" in request.args or "before" in request.args
+    before = request.args.get("before")
+    
     conn = get_connection()
-    cursor = conn.cursor()
+    cursor = tuple_cursor(conn)
     
     try:
-        cursor.execute("""
-            SELECT sc.id, sc.status, sc.created_at, 
+        query = """
+            SELECT sc.id, sc.status, sc.created_at,
+                   sc.last_message_at, sc.last_message_preview, sc.message_count,
+                   sc.unread_by_user, sc.unread_by_admin,
                    u.id as user_id, u.fullname, u.username, u.profile_image
             FROM support_chats sc
             JOIN users u ON sc.user_id = u.id
-            ORDER BY sc.created_at DESC
-        """)
-        chats = cursor.fetchall()
+        """
+        params = []
+        
+        if before:
+            try:
+                before_last_message_at, before_id = decode_page_cursor(before)
+            except ValueError:
+                return jsonify({"error": "مؤشر الصفحة غير صالح"}), 400
+            query += " WHERE (sc.last_message_at, sc.id) < (%s, %s)"
+            params.extend([before_last_message_at, before_id])
+        
+        # Walks idx_support_chats_last_message_at, stopping after one page when paged
+        query += " ORDER BY sc.last_message_at DESC NULLS LAST, sc.id DESC"
+        if paged:
+            query += " LIMIT %s"
+            params.append(page_size())
+        
+        cursor.execute(query, tuple(params))
+        chats = fetch_rows(cursor)
+        # Pass the last chat's cursor as ?before= to get the next page
+        for chat in chats:
+            chat["cursor"] = encode_page_cursor(chat["last_message_at"], chat["id"])
         return jsonify(chats)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -758,19 +1475,21 @@ def get_support_chats():
         conn.close()
 
 @app.route("/support-messages/<int:chat_id>", methods=["GET"])
+@compress(gzip_level=5, brotli_level=4)
 def get_support_messages(chat_id):
-    conn = get_connection()
-    cursor = conn.cursor()
+    conn = get_read_connection(f"chat:{chat_id}")
+    cursor = tuple_cursor(conn)
     
     try:
-        cursor.execute("""
-            SELECT sm.*, u.fullname, u.profile_image
-            FROM support_messages sm
-            JOIN users u ON sm.user_id = u.id
-            WHERE sm.chat_id = %s
-            ORDER BY sm.created_at ASC
-        """, (chat_id,))
-        messages = cursor.fetchall()
+        cursor.execute(SUPPORT_MESSAGES_QUERY, (chat_id,))
+        messages = fetch_rows(cursor)
+        
+        # Resolve authors from the user cache instead of joining users
+        authors = user_cache.get_many([message["user_id"] for message in messages])
+        messages = [message for message in messages if message["user_id"] in authors]
+        for message in messages:
+            message["fullname"] = authors[message["user_id"]]["fullname"]
+            message["profile_image"] = authors[message["user_id"]]["profile_image"]
         return jsonify(messages)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -790,11 +1509,7 @@ def add_support_message(chat_id):
     cursor = conn.cursor()
     
     try:
-        cursor.execute("""
-            INSERT INTO support_messages (chat_id, user_id, message, image_url)
-            VALUES (%s, %s, %s, %s)
-            RETURNING *
-        """, (
+        cursor.execute(INSERT_SUPPORT_MESSAGE_QUERY, (
             chat_id,
             user_id,
             data.get("message", ""),
@@ -802,7 +1517,19 @@ def add_support_message(chat_id):
         ))
         
         message = cursor.fetchone()
+        
+        # Update the inbox summary in the same transaction
+        cursor.execute(UPDATE_SUPPORT_INBOX_QUERY, (
+            message["created_at"],
+            (message["message"] or "")[:SUPPORT_PREVIEW_LENGTH],
+            message["created_at"],
+            user_id,
+            user_id,
+            chat_id
+        ))
+        
         conn.commit()
+        record_write(f"chat:{chat_id}")
         return jsonify({
             "success": True,
             "message": "تم إرسال الرسالة بنجاح",
@@ -814,6 +1541,516 @@ def add_support_message(chat_id):
         cursor.close()
         conn.close()
 
+@app.route("/support-chats/<int:chat_id>/read", methods=["POST"])
+def mark_support_chat_read(chat_id):
+    data = request.json or {}
+    user_id = data.get("user_id")
+    
+    if not user_id:
+        return jsonify({"success": False, "error": "User ID missing"}), 400
+    
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute("""
+            UPDATE support_chats SET
+            unread_by_user = 0
+            WHERE id = %s AND user_id = %s
+            RETURNING id
+        """, (chat_id, user_id))
+        
+        chat = cursor.fetchone()
+        if not chat:
+            return jsonify({"success": False, "error": "المحادثة غير موجودة"}), 404
+        
+        conn.commit()
+        return jsonify({"success": True, "unread_by_user": 0})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)})
+    finally:
+        cursor.close()
+        conn.close()
+
+@app.route("/support-chats/<int:chat_id>/admin-read", methods=["POST"])
+@admin_required
+def mark_support_chat_read_by_admin(chat_id):
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute("""
+            UPDATE support_chats SET
+            unread_by_admin = 0
+            WHERE id = %s
+            RETURNING id
+        """, (chat_id,))
+        
+        chat = cursor.fetchone()
+        if not chat:
+            return jsonify({"success": False, "error": "المحادثة غير موجودة"}), 404
+        
+        conn.commit()
+        return jsonify({"success": True, "unread_by_admin": 0})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)})
+    finally:
+        cursor.close()
+        conn.close()
+
+def compress_chat_content(content):
+    if len(content) < CHAT_COMPRESS_MIN_LENGTH:
+        return content, None
+    return "", zlib.compress(content.encode("utf-8"))
+
+def decompress_chat_content(message):
+    compressed = message.pop("content_compressed")
+    if compressed is not None:
+        message["content"] = zlib.decompress(bytes(compressed)).decode("utf-8")
+    return message
+
+
+@app.route("/chat-history/<int:user_id>", methods=["GET"])
+@owner_or_admin_required
+@compress(gzip_level=4, brotli_level=4)
+def get_chat_history(user_id):
+    limit = page_size()
+    conversation_id = request.args.get("conversation_id")
+    before = request.args.get("before")
+    
+    conn = get_read_connection(f"chat-history:{user_id}")
+    cursor = tuple_cursor(conn)
+    
+    try:
+        query = """
+            SELECT id, conversation_id, role, content, content_compressed, response_time, created_at
+            FROM chat_messages
+            WHERE user_id = %s
+        """
+        params = [user_id]
+        
+        if conversation_id:
+            query += " AND conversation_id = %s"
+            params.append(conversation_id)
+        
+        if before:
+            try:
+                before_created_at, before_id = decode_page_cursor(before)
+            except ValueError:
+                return jsonify({"error": "مؤشر الصفحة غير صالح"}), 400
+            query += " AND (created_at, id) < (%s, %s)"
+            params.extend([before_created_at, before_id])
+        
+        # Fetch one extra row to know whether another page exists
+        query += " ORDER BY created_at DESC, id DESC LIMIT %s"
+        params.append(limit + 1)
+        
+        cursor.execute(query, tuple(params))
+        messages = fetch_rows(cursor)
+        has_more = len(messages) > limit
+        messages = [decompress_chat_content(message) for message in messages[:limit]]
+        
+        return jsonify({
+            "messages": messages,
+            "next_cursor": encode_page_cursor(messages[-1]["created_at"], messages[-1]["id"]) if has_more else None
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        cursor.close()
+        conn.close()
+
+@app.route("/chat-history/<int:user_id>/conversations", methods=["GET"])
+@owner_or_admin_required
+def get_chat_conversations(user_id):
+    limit = page_size()
+    before = request.args.get("before")
+    
+    conn = get_read_connection(f"chat-history:{user_id}")
+    cursor = tuple_cursor(conn)
+    
+    try:
+        # Only touches the covering index, never the message content
+        query = """
+            SELECT conversation_id, MAX(created_at) as last_message_at,
+                   MAX(id) as last_message_id, COUNT(*) as message_count
+            FROM chat_messages
+            WHERE user_id = %s
+            GROUP BY conversation_id
+        """
+        params = [user_id]
+        
+        if before:
+            try:
+                before_created_at, before_id = decode_page_cursor(before)
+            except ValueError:
+                return jsonify({"error": "مؤشر الصفحة غير صالح"}), 400
+            query += " HAVING (MAX(created_at), MAX(id)) < (%s, %s)"
+            params.extend([before_created_at, before_id])
+        
+        query += " ORDER BY last_message_at DESC, last_message_id DESC LIMIT %s"
+        params.append(limit + 1)
+        
+        cursor.execute(query, tuple(params))
+        conversations = fetch_rows(cursor)
+        has_more = len(conversations) > limit
+        conversations = conversations[:limit]
+        
+        return jsonify({
+            "conversations": conversations,
+            "next_cursor": encode_page_cursor(
+                conversations[-1]["last_message_at"], conversations[-1]["last_message_id"]
+            ) if has_more else None
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        cursor.close()
+        conn.close()
+
+@app.route("/chat-history/<int:user_id>", methods=["POST"])
+@owner_or_admin_required
+def add_chat_message(user_id):
+    data = request.json or {}
+    
+    role = data.get("role")
+    content = data.get("content")
+    if not isinstance(role, str) or not isinstance(content, str) or not role or not content:
+        return jsonify({"success": False, "error": "مطلوب الدور والمحتوى كنصوص"}), 400
+    
+    stored_content, content_compressed = compress_chat_content(content)
+    
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute("""
+            INSERT INTO chat_messages (user_id, conversation_id, role, content, content_compressed, response_time)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            RETURNING id, conversation_id, role, response_time, created_at
+        """, (
+            user_id,
+            data.get("conversation_id"),
+            role,
+            stored_content,
+            psycopg2.Binary(content_compressed) if content_compressed is not None else None,
+            data.get("response_time")
+        ))
+        
+        message = cursor.fetchone()
+        conn.commit()
+        record_write(f"chat-history:{user_id}")
+        message["content"] = content
+        return jsonify({
+            "success": True,
+            "message": "تم حفظ الرسالة بنجاح",
+            "data": message
+        })
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)})
+    finally:
+        cursor.close()
+        conn.close()
+
+@app.route("/cache-stats", methods=["GET"])
+@admin_required
+def get_cache_stats():
+    return jsonify({"user_cache": user_cache.stats()})
+
+@app.route("/jobs", methods=["GET"])
+@admin_required
+def get_jobs():
+    conn = get_connection()
+    cursor = tuple_cursor(conn)
+    
+    try:
+        status = request.args.get("status")
+        cursor.execute("""
+            SELECT id, kind, status, priority, attempts, max_attempts, run_at,
+                   interval_seconds, last_error, created_at, started_at, finished_at
+            FROM jobs
+            WHERE %s IS NULL OR status = %s
+            ORDER BY id DESC
+            LIMIT 100
+        """, (status, status))
+        jobs = fetch_rows(cursor)
+        return jsonify(jobs)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        cursor.close()
+        conn.close()
+
+@app.route("/jobs/<int:job_id>", methods=["GET"])
+@admin_required
+def get_job(job_id):
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute("SELECT * FROM jobs WHERE id = %s", (job_id,))
+        job = cursor.fetchone()
+        if not job:
+            return jsonify({"error": "المهمة غير موجودة"}), 404
+        
+        return jsonify(job)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        cursor.close()
+        conn.close()
+
+# Background jobs
+JOB_HANDLERS = {}
+
+def job_handler(kind):
+    def decorator(f):
+        JOB_HANDLERS[kind] = f
+        return f
+    return decorator
+
+def enqueue_job(cursor, kind, payload=None, priority=0, delay=0, max_attempts=5):
+    # Runs in the caller's transaction, so the job only exists if the caller commits
+    cursor.execute("""
+        INSERT INTO jobs (kind, payload, priority, max_attempts, run_at)
+        VALUES (%s, %s, %s, %s, NOW() + %s * INTERVAL '1 second')
+        RETURNING id
+    """, (kind, Json(payload or {}), priority, max_attempts, delay))
+    return cursor.fetchone()["id"]
+
+def schedule_periodic_job(cursor, kind, interval_seconds, payload=None, priority=0):
+    cursor.execute("""
+        INSERT INTO jobs (kind, payload, priority, interval_seconds)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (kind) WHERE interval_seconds IS NOT NULL
+        DO UPDATE SET interval_seconds = EXCLUDED.interval_seconds
+    """, (kind, Json(payload or {}), priority, interval_seconds))
+
+@job_handler("propagate_api_key")
+def propagate_api_key(cursor, payload):
+    # Propagate the current key, not the one this job was queued with: a retried older
+    # job must not write back a key a newer one replaced. The share lock holds off a
+    # settings update until this job commits, and that update queues its own job.
+    cursor.execute("SELECT api_key FROM site_settings WHERE id = 1 FOR SHARE")
+    settings = cursor.fetchone()
+    if settings is None:
+        return {"updated_users": 0}
+    cursor.execute("""
+        UPDATE users SET
+        api_key = %s
+    """, (settings["api_key"],))
+    updated_users = cursor.rowcount
+    user_cache.invalidate(cursor)
+    return {"updated_users": updated_users}
+
+@job_handler("delete_user")
+def delete_user(cursor, payload):
+    user_id = payload["user_id"]
+    
+    # Replies the user wrote in other users' chats go too; lock those chats so their
+    # inbox summaries can be rebuilt without racing new messages
+    cursor.execute("""
+        SELECT id FROM support_chats
+        WHERE user_id <> %s
+        AND id IN (SELECT chat_id FROM support_messages WHERE user_id = %s)
+        ORDER BY id
+        FOR UPDATE
+    """, (user_id, user_id))
+    other_chats = [row["id"] for row in cursor.fetchall()]
+    
+    if other_chats:
+        # The chat owner's unread messages are the newest unread_by_user replies;
+        # drop the ones being deleted from that count
+        cursor.execute("""
+            UPDATE support_chats sc
+            SET unread_by_user = sc.unread_by_user - unread.deleted
+            FROM (
+                SELECT replies.chat_id, COUNT(*) as deleted
+                FROM (
+                    SELECT sm.chat_id, sm.user_id, ROW_NUMBER() OVER (
+                        PARTITION BY sm.chat_id ORDER BY sm.created_at DESC, sm.id DESC
+                    ) as position
+                    FROM support_messages sm
+                    JOIN support_chats owner ON owner.id = sm.chat_id
+                    WHERE sm.chat_id = ANY(%s) AND sm.user_id <> owner.user_id
+                ) replies
+                JOIN support_chats chat ON chat.id = replies.chat_id
+                WHERE replies.user_id = %s AND replies.position <= chat.unread_by_user
+                GROUP BY replies.chat_id
+            ) unread
+            WHERE sc.id = unread.chat_id
+        """, (other_chats, user_id))
+    
+    cursor.execute("""
+        DELETE FROM support_messages
+        WHERE user_id = %s
+        OR chat_id IN (SELECT id FROM support_chats WHERE user_id = %s)
+    """, (user_id, user_id))
+    
+    if other_chats:
+        cursor.execute("""
+            UPDATE support_chats sc
+            SET last_message_at = COALESCE(last.created_at, sc.created_at),
+                last_message_preview = CASE
+                    WHEN last.created_at IS NULL THEN NULL
+                    ELSE LEFT(COALESCE(last.message, ''), %s)
+                END,
+                message_count = (SELECT COUNT(*) FROM support_messages WHERE chat_id = sc.id)
+            FROM support_chats chat
+            LEFT JOIN LATERAL (
+                SELECT message, created_at
+                FROM support_messages
+                WHERE chat_id = chat.id
+                ORDER BY created_at DESC, id DESC
+                LIMIT 1
+            ) last ON TRUE
+            WHERE sc.id = chat.id AND sc.id = ANY(%s)
+        """, (SUPPORT_PREVIEW_LENGTH, other_chats))
+    
+    cursor.execute("DELETE FROM support_chats WHERE user_id = %s", (user_id,))
+    cursor.execute("DELETE FROM chat_messages WHERE user_id = %s", (user_id,))
+    cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
+    deleted = cursor.rowcount
+    user_cache.invalidate(cursor, user_id)
+    return {"deleted": deleted}
+
+@job_handler("refresh_statistics")
+def refresh_statistics(cursor, payload):
+    statistics = compute_statistics(cursor)
+    cursor.execute("""
+        INSERT INTO statistics_snapshot (id, data, computed_at)
+        VALUES (1, %s, NOW())
+        ON CONFLICT (id) DO UPDATE SET
+        data = EXCLUDED.data,
+        computed_at = EXCLUDED.computed_at
+    """, (Json(statistics),))
+
+def retry_or_fail_jobs(cursor, error, condition, params):
+    # Periodic jobs never give up; they just try again on the next backoff
+    cursor.execute(f"""
+        UPDATE jobs SET
+        status = CASE
+            WHEN attempts >= max_attempts AND interval_seconds IS NULL THEN 'failed'
+            ELSE 'queued'
+        END,
+        last_error = %s,
+        finished_at = NOW(),
+        run_at = NOW() + LEAST(%s * POWER(2, GREATEST(attempts - 1, 0)), %s) * INTERVAL '1 second'
+        WHERE {condition}
+    """, (error, JOB_RETRY_BASE, JOB_RETRY_MAX) + tuple(params))
+
+def claim_job(cursor):
+    # A running job stays locked by its worker, so only jobs whose worker died are reclaimed
+    retry_or_fail_jobs(cursor, "انتهت مهلة المهمة", """
+        id IN (
+            SELECT id FROM jobs
+            WHERE status = 'running'
+            AND started_at < NOW() - %s * INTERVAL '1 second'
+            FOR UPDATE SKIP LOCKED
+        )
+    """, (JOB_TIMEOUT,))
+    
+    cursor.execute("""
+        UPDATE jobs SET
+        status = 'running',
+        attempts = attempts + 1,
+        started_at = NOW()
+        WHERE id = (
+            SELECT id FROM jobs
+            WHERE status = 'queued' AND run_at <= NOW()
+            ORDER BY priority DESC, run_at
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING *
+    """)
+    return cursor.fetchone()
+
+def run_job(conn, job):
+    cursor = conn.cursor()
+    try:
+        # Hold the job's row lock until it finishes
+        cursor.execute("SELECT id FROM jobs WHERE id = %s FOR UPDATE", (job["id"],))
+        
+        handler = JOB_HANDLERS.get(job["kind"])
+        if handler is None:
+            raise ValueError(f"Unknown job kind: {job['kind']}")
+        result = handler(cursor, job["payload"])
+        
+        if job["interval_seconds"]:
+            cursor.execute("""
+                UPDATE jobs SET
+                status = 'queued', attempts = 0, result = %s, last_error = NULL,
+                finished_at = NOW(), run_at = NOW() + interval_seconds * INTERVAL '1 second'
+                WHERE id = %s
+            """, (Json(result), job["id"]))
+        else:
+            cursor.execute("""
+                UPDATE jobs SET
+                status = 'done', result = %s, last_error = NULL, finished_at = NOW()
+                WHERE id = %s
+            """, (Json(result), job["id"]))
+        conn.commit()
+    except Exception as e:
+        print(f"فشلت المهمة {job['id']} ({job['kind']}): {e}")
+        try:
+            conn.rollback()
+            retry_or_fail_jobs(cursor, str(e), "id = %s", (job["id"],))
+            conn.commit()
+        except psycopg2.Error as db_error:
+            # The job stays running, unlocked, until claim_job reclaims it
+            print(f"تعذر تسجيل فشل المهمة {job['id']}: {db_error}")
+            raise
+    finally:
+        cursor.close()
+
+def worker_loop():
+    conn = None
+    while True:
+        try:
+            if conn is None:
+                conn = get_connection()
+            cursor = conn.cursor()
+            job = claim_job(cursor)
+            conn.commit()
+            cursor.close()
+            
+            if job:
+                run_job(conn, job)
+            else:
+                time.sleep(JOB_POLL_INTERVAL)
+        except psycopg2.Error as e:
+            print(f"انقطع الاتصال بقاعدة البيانات: {e}")
+            if conn is not None:
+                try:
+                    conn.close()
+                except psycopg2.Error:
+                    pass
+            conn = None
+            time.sleep(JOB_POLL_INTERVAL)
+
+def run_workers(count=JOB_WORKERS):
+    # Forked workers must not share the parent's pooled connections
+    connection_pool.clear()
+    workers = []
+    for _ in range(count):
+        worker = multiprocessing.Process(target=worker_loop, daemon=True)
+        worker.start()
+        workers.append(worker)
+    print(f"تم تشغيل {count} من عمال المهام الخلفية")
+    
+    # Replace any worker that dies instead of letting the pool shrink
+    while True:
+        time.sleep(JOB_POLL_INTERVAL)
+        for index, worker in enumerate(workers):
+            if not worker.is_alive():
+                print(f"توقف العامل {worker.pid} (رمز الخروج {worker.exitcode})، جاري إعادة تشغيله")
+                workers[index] = multiprocessing.Process(target=worker_loop, daemon=True)
+                workers[index].start()
+
 if __name__ == "__main__":
     init_db()
-    app.run(debug=True, host="0.0.0.0", port=5000)
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] == "worker":
+        run_workers()
+    else:
+        app.run(debug=True, host="0.0.0.0", port=5000)
\ No newline at end of file